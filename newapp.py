@@ -1,15 +1,22 @@
 # -*- coding: utf-8 -*-
-import os, datetime, secrets, re, json
+import os, secrets, re, json, random, hashlib, time, threading, functools, datetime
+from urllib.parse import quote as urlquote
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from pathlib import Path
 
-from flask import Flask, render_template, request, redirect, url_for, session, abort, jsonify, flash
-from sqlalchemy import create_engine, text
+from flask import Flask, render_template, request, redirect, url_for, session, abort, jsonify, flash, stream_template
+from flask.json.provider import JSONProvider
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.pool import StaticPool
 from google.oauth2 import id_token
 from google.auth.transport import requests as grequests
 from dotenv import load_dotenv
+from cachetools import TTLCache, LRUCache
+from cachecontrol.adapter import CacheControlAdapter
+from flask_compress import Compress
 import requests as pyrequests  # server-side autofill
+import orjson
 
 APP_TITLE = "NewMood"
 BASE_DIR = Path(__file__).resolve().parent
@@ -20,52 +27,353 @@ YOUTUBE_OEMBED = "https://www.youtube.com/oembed?format=json&url="
 SPOTIFY_OEMBED = "https://open.spotify.com/oembed?url="
 ITUNES_LOOKUP = "https://itunes.apple.com/lookup?id="  # Apple Music 使用 iTunes 公開查詢，不需 API 金鑰
 
+# oEmbed/iTunes 共用連線池：TLS 握手攤提到多次請求，冷路徑省 1–2 個 RTT
+_OEMBED_SESSION = pyrequests.Session()
+_OEMBED_SESSION.mount("https://", pyrequests.adapters.HTTPAdapter(
+    pool_connections=16, pool_maxsize=64,
+    max_retries=pyrequests.adapters.Retry(total=2, backoff_factor=0.2,
+                                          status_forcelist=[429, 502, 503, 504]),
+))
+_OEMBED_TIMEOUT = (1.5, 4)  # (connect, read)
+
+# 同一首歌重複貼上直接回快取（oEmbed 結果對同一 URL 幾乎不變）
+_AUTOFILL_CACHE = TTLCache(maxsize=10_000, ttl=86400)
+# 查不到東西的連結記 60 秒，免得壞連結連環打上游
+_AUTOFILL_NEG_CACHE = TTLCache(maxsize=2048, ttl=60)
+_AUTOFILL_LOCK = threading.Lock()
+_SPOTIFY_PATH_RE = re.compile(r"open\.spotify\.com/(?:intl-[^/]+/)?(track|album|episode|playlist)/([A-Za-z0-9]+)")
+
+# meta 快取過期後改走條件式 GET：留著 ETag/Last-Modified，304 就不必重傳 body
+_OEMBED_VALIDATORS = LRUCache(maxsize=10_000)  # url -> (etag, last_modified, parsed_json)
+_OEMBED_VALIDATORS_LOCK = threading.Lock()
+
+def _oembed_get_json(url: str):
+    with _OEMBED_VALIDATORS_LOCK:
+        stale = _OEMBED_VALIDATORS.get(url)
+    headers = {}
+    if stale:
+        etag, last_mod, _ = stale
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_mod:
+            headers["If-Modified-Since"] = last_mod
+    r = _OEMBED_SESSION.get(url, headers=headers, timeout=_OEMBED_TIMEOUT)
+    if r.status_code == 304 and stale:
+        return stale[2]
+    if not r.ok:
+        return None
+    d = r.json()
+    with _OEMBED_VALIDATORS_LOCK:
+        _OEMBED_VALIDATORS[url] = (r.headers.get("ETag"), r.headers.get("Last-Modified"), d)
+    return d
+
+# 共用一個 Session 驗 Google token：JWKS 走 keep-alive，不必每次登入重握 TLS；
+# CacheControlAdapter 讓 certs 回應照 Cache-Control（約 1hr）直接吃快取，連網路都不用
+_GOOGLE_SESSION = pyrequests.Session()
+_GOOGLE_SESSION.mount("https://", CacheControlAdapter(pool_connections=4, pool_maxsize=16))
+_GOOGLE_REQUEST = grequests.Request(session=_GOOGLE_SESSION)
+
+# 同一個 credential 重送時跳過簽章驗證（exp 另外再檢查）
+_TOKEN_CACHE = TTLCache(maxsize=4096, ttl=300)
+_TOKEN_LOCK = threading.Lock()
+# 登入尖峰時 RSA 驗簽是 CPU 密集，丟進小 pool 限流並加逾時，不讓它佔住 request thread
+_JWT_POOL = ThreadPoolExecutor(max_workers=4)
+
+# Admin 三個 COUNT(*) 是全表掃描，30 秒內重刷直接吃快取
+_ADMIN_METRICS_CACHE = TTLCache(maxsize=1, ttl=30)
+_ADMIN_METRICS_LOCK = threading.Lock()
+
 # ===== Helpers for link parsing =====
+_YT_RE = re.compile(r"(?:youtu\.be/|[?&]v=|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})")
+
+def yt_thumb(vid: str | None) -> str | None:
+    # 由影片 id 組縮圖 URL；id 在寫入時就存進 recommendations.yt_id
+    return f"https://img.youtube.com/vi/{vid}/hqdefault.jpg" if vid else None
+
+
+_APPLE_I_RE  = re.compile(r"[?&]i=(\d+)")
+_APPLE_ID_RE = re.compile(r"/id(\d+)")
+
 def extract_yt_id(url: str) -> str | None:
-    # 僅支援 YouTube Music / YouTube 影片 ID（11 碼）
-    pats = [
-        r"youtu\.be/([A-Za-z0-9_-]{11})",
-        r"[?&]v=([A-Za-z0-9_-]{11})",
-        r"/shorts/([A-Za-z0-9_-]{11})",
-    ]
-    for p in pats:
-        m = re.search(p, url)
-        if m:
-            return m.group(1)
-    return None
+    # 僅支援 YouTube Music / YouTube 影片 ID（11 碼）；單一 alternation 掃一次就好
+    m = _YT_RE.search(url)
+    return m.group(1) if m else None
 
 def extract_apple_id(url: str) -> str | None:
     # 盡量從 Apple Music URL 抓 track/album id
     # e.g. https://music.apple.com/.../id123456789?i=987654321
-    m = re.search(r"[?&]i=(\d+)", url)
-    if m: return m.group(1)
-    m = re.search(r"/id(\d+)", url)
-    if m: return m.group(1)
+    m = _APPLE_I_RE.search(url) or _APPLE_ID_RE.search(url)
+    return m.group(1) if m else None
+
+def _autofill_cache_key(link: str):
+    # 正規化快取鍵：只看 provider + 內容 id，忽略其餘查詢參數
+    if "youtube" in link or "youtu.be" in link:
+        vid = extract_yt_id(link)
+        return ("yt", vid) if vid else None
+    if "open.spotify.com" in link:
+        m = _SPOTIFY_PATH_RE.search(link)
+        return ("sp", m.group(1), m.group(2)) if m else None
+    if "music.apple.com" in link:
+        aid = extract_apple_id(link)
+        return ("apple", aid) if aid else None
     return None
 
+# ===== Link resolving（/autofill 與 /autofill/batch 共用） =====
+_AUTOFILL_POOL = ThreadPoolExecutor(max_workers=8)  # batch 解析用；oEmbed 是純 I/O
+
+def _resolve_youtube(link: str, fast: bool):
+    meta = {"title": "", "artist": "", "thumbnail": ""}
+    vid = extract_yt_id(link)
+    if vid:
+        meta["thumbnail"] = f"https://img.youtube.com/vi/{vid}/hqdefault.jpg"
+        if fast:
+            # 快速模式：縮圖由影片 id 決定，不等 oEmbed 補 title/artist
+            return meta, None
+    d = _oembed_get_json(YOUTUBE_OEMBED + urlquote(link))
+    if d:
+        meta["title"] = d.get("title","")
+        meta["artist"] = d.get("author_name","")
+    return meta, None
+
+def _resolve_spotify(link: str, fast: bool):
+    meta = {"title": "", "artist": "", "thumbnail": ""}
+    d = _oembed_get_json(SPOTIFY_OEMBED + urlquote(link))
+    if d:
+        title = (d.get("title") or "").strip()
+        if "·" in title:
+            a,b = [x.strip() for x in title.split("·",1)]
+            meta["title"] = a
+            meta["artist"] = d.get("author_name") or b
+        else:
+            meta["title"] = title
+            meta["artist"] = d.get("author_name","")
+        if d.get("thumbnail_url"):
+            # Spotify 縮圖通常已是正方形
+            meta["thumbnail"] = d["thumbnail_url"]
+    return meta, None
+
+def _resolve_apple(link: str, fast: bool):
+    meta = {"title": "", "artist": "", "thumbnail": ""}
+    aid = extract_apple_id(link)
+    if not aid:
+        return None, "apple_music_id_not_found"
+    d = _oembed_get_json(ITUNES_LOOKUP + aid)
+    if d:
+        if d.get("resultCount",0) > 0:
+            item = d["results"][0]
+            meta["title"]  = item.get("trackName") or item.get("collectionName") or ""
+            meta["artist"] = item.get("artistName","")
+            art = item.get("artworkUrl100","")
+            if art:
+                meta["thumbnail"] = art.replace("100x100", "600x600")
+    return meta, None
+
+# provider 判斷一次掃描 + dict dispatch，新來源只要多掛一個 handler
+_PROVIDER_RE = re.compile(r"(music\.youtube\.com|youtu\.be|youtube\.com|open\.spotify\.com|music\.apple\.com)")
+_PROVIDER_HANDLERS = {
+    "music.youtube.com": _resolve_youtube,
+    "youtu.be": _resolve_youtube,
+    "youtube.com": _resolve_youtube,
+    "open.spotify.com": _resolve_spotify,
+    "music.apple.com": _resolve_apple,
+}
+
+def resolve_link(link: str, fast: bool = False):
+    # 回傳 (meta, error)；error 非 None 時 meta 為 None
+    m = _PROVIDER_RE.search(link)
+    if not m:
+        return None, "only_youtube_music_spotify_apple_music_supported"
+
+    cache_key = _autofill_cache_key(link)
+    if cache_key:
+        with _AUTOFILL_LOCK:
+            cached = _AUTOFILL_CACHE.get(cache_key)
+            negative = cache_key in _AUTOFILL_NEG_CACHE
+        if cached:
+            return cached, None
+        if negative:
+            return {"title": "", "artist": "", "thumbnail": ""}, None
+
+    meta, err = _PROVIDER_HANDLERS[m.group(1)](link, fast)
+    if err:
+        return None, err
+
+    if cache_key:
+        with _AUTOFILL_LOCK:
+            if meta["title"]:
+                _AUTOFILL_CACHE[cache_key] = meta
+            elif not fast:  # fast 模式的縮圖-only 結果不進快取，以免蓋掉完整 meta
+                if meta["thumbnail"]:
+                    _AUTOFILL_CACHE[cache_key] = meta
+                else:
+                    _AUTOFILL_NEG_CACHE[cache_key] = True
+    return meta, None
+
+# ===== SQL statements（模組層建好 TextClause，request 路徑不再重建/重 hash） =====
+# upsert 與改暱稱都直接 RETURNING，一個 statement 就拿回 session 需要的欄位
+# created_at 寫在 statement 裡而不是靠 DDL default：
+# CREATE TABLE IF NOT EXISTS 不會幫既有資料庫補 default，升級上來的表會寫出 NULL
+_Q_UPSERT_ACCOUNT = text("""
+    INSERT INTO accounts (google_sub, email, nickname, created_at)
+    VALUES (:sub, :email, :nickname, strftime('%s','now'))
+    ON CONFLICT(email) DO UPDATE SET google_sub = excluded.google_sub
+    RETURNING id, email, nickname
+""")
+_Q_UPDATE_NICKNAME = text("UPDATE accounts SET nickname = :n WHERE id = :i RETURNING id, email, nickname")
+
+_Q_INSERT_RECO = text("""
+    INSERT INTO recommendations (account_id, title, artist, reason, link, yt_id, created_at)
+    VALUES (:aid, :t, :a, :r, :l, :yt, strftime('%s','now'))
+""")
+_Q_RECO_ID_RANGE = text("SELECT MIN(id), MAX(id) FROM recommendations WHERE account_id != :aid")
+# 抽卡＋寫入 draws 合併成單一 statement（SQLite >= 3.35 的 RETURNING）
+_Q_DRAW_INTO_DRAWS = text("""
+    INSERT INTO draws (account_id, recommendation_id, created_at)
+    SELECT :aid, r.id, strftime('%s','now')
+    FROM recommendations r
+    WHERE r.id >= :start AND r.account_id != :aid
+    ORDER BY r.id
+    LIMIT 1
+    RETURNING recommendation_id
+""")
+_Q_RECO_DETAILS = text("""
+    SELECT r.id, r.title, r.artist, r.reason, r.link, r.yt_id,
+           a.nickname
+    FROM recommendations r
+    LEFT JOIN accounts a ON a.id = r.account_id
+    WHERE r.id = :rid
+""")
+
+_Q_HISTORY = text("""
+    SELECT d.id as draw_id, d.created_at,
+           r.title, r.artist, r.reason, r.link, r.yt_id,
+           a.nickname
+    FROM draws d
+    JOIN recommendations r ON r.id = d.recommendation_id
+    JOIN accounts a ON a.id = r.account_id
+    WHERE d.account_id = :aid AND d.id < :cursor
+    ORDER BY d.id DESC
+    LIMIT 21
+""")  # 一頁 20 筆，多抓 1 筆判斷有沒有下一頁
+
+_Q_ADMIN_METRICS = text("""
+    SELECT
+      (SELECT COUNT(*) FROM accounts) as users,
+      (SELECT COUNT(*) FROM recommendations) as recos,
+      (SELECT COUNT(*) FROM draws) as draws
+""")
+_Q_ADMIN_LATEST = text("""
+    SELECT r.id, r.title, r.artist, r.reason, r.link, r.created_at,
+           a.email, a.nickname
+    FROM recommendations r
+    LEFT JOIN accounts a ON a.id = r.account_id
+    ORDER BY r.id DESC LIMIT 50
+""")
+
+class ORJSONProvider(JSONProvider):
+    # jsonify / request.get_json 改走 orjson（C 實作，比 stdlib 快數倍）
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:  # session cookie 的 TaggedJSONSerializer 會帶 object_hook，orjson 不支援
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # jsonify 直接回 orjson 的 bytes，省掉 decode 再讓 werkzeug encode 回去
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+def _secret_key() -> str:
+    # 隨機 fallback 的 key 在每個 worker / 每次重啟都不同，session 全失效，
+    # 使用者被迫重跑最貴的 /auth/google。production 直接擋下，dev 落地一把固定 key
+    key = (os.environ.get("SECRET_KEY") or "").strip()
+    if key:
+        return key
+    if os.environ.get("FLASK_ENV") == "production":
+        raise RuntimeError("SECRET_KEY must be set in production")
+    path = BASE_DIR / ".secret"
+    if path.exists():
+        return path.read_text().strip()
+    key = secrets.token_hex(32)
+    path.write_text(key)
+    path.chmod(0o600)
+    return key
+
 # ===== App =====
 def create_app():
     app = Flask(__name__, instance_relative_config=True)
+    app.json = ORJSONProvider(app)
     app.config.from_mapping(
-        SECRET_KEY=os.environ.get("SECRET_KEY") or secrets.token_hex(32),
+        SECRET_KEY=_secret_key(),
         DATABASE=str((BASE_DIR / "instance" / "newmood.db").resolve()),
         GOOGLE_CLIENT_ID=(os.environ.get("GOOGLE_CLIENT_ID") or "").strip(),
         ADMIN_EMAILS=[e.strip().lower() for e in (os.environ.get("ADMIN_EMAILS") or "").split(",") if e.strip()],
         ADMIN_PASS=(os.environ.get("ADMIN_PASS") or "").strip(),
         GA_MEASUREMENT_ID=(os.environ.get("GA_MEASUREMENT_ID") or "").strip(),
+        COMPRESS_MIN_SIZE=512,
     )
+    Compress(app)  # gzip/br for templated pages（history/admin 最有感）
 
     os.makedirs(app.instance_path, exist_ok=True)
 
+    # SQLite 調校：WAL 讓讀寫並行、少一次 fsync；每條新連線都要套用
+    is_memory_db = app.config["DATABASE"] == ":memory:"
+
+    # WAL 之下讀者可以並行，改用 QueuePool 讓每個 worker thread 有自己的連線。
+    # :memory: 例外：每條新連線都是獨立的空資料庫，只能用 StaticPool 共用一條
+    if is_memory_db:
+        pool_kwargs = {"poolclass": StaticPool}
+    else:
+        pool_kwargs = {
+            "pool_size": 8,
+            "max_overflow": 16,
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,  # 半小時回收，mmap/WAL 快照不會抱著舊頁不放
+        }
     engine = create_engine(
         f"sqlite:///{app.config['DATABASE']}",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
+        connect_args={"check_same_thread": False, "timeout": 5, "cached_statements": 256},
+        # 語句就那十來條，換成無上限 dict 免去 LRU 的簿記
+        execution_options={"compiled_cache": {}},
         future=True,
+        **pool_kwargs,
     )
     app.engine = engine  # type: ignore
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        if not is_memory_db:
+            cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA cache_size=-20000")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.execute("PRAGMA busy_timeout=5000")
+        cur.execute("PRAGMA foreign_keys=ON")
+        cur.close()
+
     init_db(app, engine)
 
+    # 開機確認一次 WAL 真的有生效（例如放在網路檔案系統上會悄悄退回 delete mode）
+    if not is_memory_db:
+        with engine.connect() as conn:
+            mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+        if (mode or "").lower() != "wal":
+            app.logger.warning("SQLite journal_mode=%s (expected wal)", mode)
+
+    @app.template_filter("dt")
+    def format_ts(v):
+        # created_at 現在存 unix 整數，顯示時才轉字串
+        if not v:
+            return "—"
+        try:
+            return datetime.datetime.fromtimestamp(int(v), datetime.timezone.utc).strftime("%Y-%m-%d %H:%M")
+        except (TypeError, ValueError, OSError):
+            return str(v)
+
     # ----- session helpers -----
     def current_user():
         u = session.get("user")
@@ -93,7 +401,15 @@ def create_app():
         if not credential:
             return jsonify({"ok": False, "error": "missing_credential"}), 400
         try:
-            idinfo = id_token.verify_oauth2_token(credential, grequests.Request(), app.config["GOOGLE_CLIENT_ID"])
+            key = hashlib.sha256(credential.encode()).digest()[:16]
+            with _TOKEN_LOCK:
+                idinfo = _TOKEN_CACHE.get(key)
+            if not idinfo or idinfo.get("exp", 0) <= time.time() + 5:
+                idinfo = _JWT_POOL.submit(
+                    id_token.verify_oauth2_token, credential, _GOOGLE_REQUEST, app.config["GOOGLE_CLIENT_ID"]
+                ).result(timeout=5)
+                with _TOKEN_LOCK:
+                    _TOKEN_CACHE[key] = idinfo
             email = idinfo.get("email")
             sub = idinfo.get("sub")
             name = idinfo.get("name") or ""
@@ -101,15 +417,13 @@ def create_app():
                 raise ValueError("Invalid token payload")
 
             with app.engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO accounts (google_sub, email, nickname, created_at)
-                    VALUES (:sub, :email, :nickname, :now)
-                    ON CONFLICT(email) DO UPDATE SET google_sub = excluded.google_sub
-                """), {"sub": sub, "email": email, "nickname": name, "now": datetime.datetime.utcnow().isoformat()})
-                row = conn.execute(text("SELECT id, email, nickname FROM accounts WHERE email = :e"), {"e": email}).mappings().first()
+                row = conn.execute(_Q_UPSERT_ACCOUNT, {"sub": sub, "email": email, "nickname": name}).mappings().first()
 
             session["user"] = {"id": row["id"], "email": row["email"], "nickname": row["nickname"]}
             return jsonify({"ok": True})
+        except FuturesTimeout:
+            # str(TimeoutError()) 是空字串，直接這樣回 client 什麼都看不到
+            return jsonify({"ok": False, "error": "token_verification_timeout"}), 400
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 400
 
@@ -133,8 +447,7 @@ def create_app():
             flash("Nickname cannot be empty", "error")
             return redirect(url_for("profile_get"))
         with app.engine.begin() as conn:
-            conn.execute(text("UPDATE accounts SET nickname = :n WHERE id = :i"), {"n": nickname, "i": u["id"]})
-            row = conn.execute(text("SELECT id, email, nickname FROM accounts WHERE id = :i"), {"i": u["id"]}).mappings().first()
+            row = conn.execute(_Q_UPDATE_NICKNAME, {"n": nickname, "i": u["id"]}).mappings().first()
         session["user"] = {"id": row["id"], "email": row["email"], "nickname": row["nickname"]}
         flash("Profile updated", "success")
         return redirect(url_for("index"))
@@ -142,66 +455,45 @@ def create_app():
     # ======= AutoFill (only YT Music / Spotify / Apple Music) =======
     @app.post("/autofill")
     def autofill():
-        link = (request.json or {}).get("link", "").strip()
+        payload = request.get_json(silent=True) or {}
+        link = (payload.get("link") or "").strip()
         if not link:
             return jsonify({"ok": False, "error": "missing_link"}), 400
-
-        # 僅允許三種來源
-        allow = any(s in link for s in ["music.youtube.com", "youtu.be", "youtube.com", "open.spotify.com", "music.apple.com"])
-        if not allow:
-            return jsonify({"ok": False, "error": "only_youtube_music_spotify_apple_music_supported"}), 400
-
-        meta = {"title": "", "artist": "", "thumbnail": ""}
-
         try:
-            # YouTube Music / YouTube
-            if "youtube" in link or "youtu.be" in link:
-                vid = extract_yt_id(link)
-                if vid:
-                    meta["thumbnail"] = f"https://img.youtube.com/vi/{vid}/hqdefault.jpg"
-                r = pyrequests.get(YOUTUBE_OEMBED + pyrequests.utils.quote(link), timeout=6)
-                if r.ok:
-                    d = r.json()
-                    meta["title"] = d.get("title","")
-                    meta["artist"] = d.get("author_name","")
-
-            # Spotify
-            elif "open.spotify.com" in link:
-                r = pyrequests.get(SPOTIFY_OEMBED + pyrequests.utils.quote(link), timeout=6)
-                if r.ok:
-                    d = r.json()
-                    title = (d.get("title") or "").strip()
-                    if "·" in title:
-                        a,b = [x.strip() for x in title.split("·",1)]
-                        meta["title"] = a
-                        meta["artist"] = d.get("author_name") or b
-                    else:
-                        meta["title"] = title
-                        meta["artist"] = d.get("author_name","")
-                    if d.get("thumbnail_url"):
-                        # Spotify 縮圖通常已是正方形
-                        meta["thumbnail"] = d["thumbnail_url"]
-
-            # Apple Music
-            elif "music.apple.com" in link:
-                aid = extract_apple_id(link)
-                if not aid:
-                    return jsonify({"ok": False, "error": "apple_music_id_not_found"}), 400
-                r = pyrequests.get(ITUNES_LOOKUP + aid, timeout=6)
-                if r.ok:
-                    d = r.json()
-                    if d.get("resultCount",0) > 0:
-                        item = d["results"][0]
-                        meta["title"]  = item.get("trackName") or item.get("collectionName") or ""
-                        meta["artist"] = item.get("artistName","")
-                        art = item.get("artworkUrl100","")
-                        if art:
-                            meta["thumbnail"] = art.replace("100x100", "600x600")
-
+            # fast=1（query 或 body 都收）：YouTube 連結只回推得出來的縮圖，完全不打 oEmbed
+            fast = bool(request.args.get("fast") or payload.get("fast"))
+            meta, err = resolve_link(link, fast=fast)
+            if err:
+                return jsonify({"ok": False, "error": err}), 400
             return jsonify({"ok": True, "meta": meta})
         except Exception as e:
             return jsonify({"ok": False, "error": f"autofill_failed: {e}"}), 500
 
+    @app.post("/autofill/batch")
+    def autofill_batch():
+        # 多條連結一次解析：thread pool 同時打各家 oEmbed，牆鐘時間從加總變最大值
+        payload = request.get_json(silent=True) or {}
+        links = payload.get("links")
+        if not isinstance(links, list) or not links:
+            return jsonify({"ok": False, "error": "missing_links"}), 400
+        links = links[:25]  # 一批最多 25 條，免得單一請求佔滿 pool
+
+        def one(raw):
+            # 非字串（null、數字…）一律當 missing_link，str(None) 會變 "None"
+            link = raw.strip() if isinstance(raw, str) else ""
+            if not link:
+                return {"link": raw, "ok": False, "error": "missing_link"}
+            try:
+                meta, err = resolve_link(link)
+                if err:
+                    return {"link": link, "ok": False, "error": err}
+                return {"link": link, "ok": True, "meta": meta}
+            except Exception as e:
+                return {"link": link, "ok": False, "error": f"autofill_failed: {e}"}
+
+        results = list(_AUTOFILL_POOL.map(one, links))  # 保留輸入順序
+        return jsonify({"ok": True, "results": results})
+
     # ====== Submit / Draw ======
     @app.post("/submit")
     def submit():
@@ -209,10 +501,11 @@ def create_app():
         if not u:
             return jsonify({"ok": False, "error": "not_logged_in"}), 401
 
-        title  = (request.form.get("title")  or "").strip()
-        artist = (request.form.get("artist") or "").strip()
-        reason = (request.form.get("reason") or "").strip()
-        link   = (request.form.get("link")   or "").strip()
+        f = request.form  # 只走一次 werkzeug 的表單解析/proxy
+        title  = (f.get("title")  or "").strip()
+        artist = (f.get("artist") or "").strip()
+        reason = (f.get("reason") or "").strip()
+        link   = (f.get("link")   or "").strip()
         if not link:
             return jsonify({"ok": False, "error": "missing_link"}), 400
         # Title/Artist 由 AutoFill 帶入（隱藏欄位），保底再驗一次
@@ -220,78 +513,81 @@ def create_app():
             return jsonify({"ok": False, "error": "missing_title_artist_autofill_first"}), 400
 
         with app.engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO recommendations (account_id, title, artist, reason, link, created_at)
-                VALUES (:aid, :t, :a, :r, :l, :now)
-            """), {"aid": u["id"], "t": title, "a": artist, "r": reason, "l": link, "now": datetime.datetime.utcnow().isoformat()})
-
-            row = conn.execute(text("""
-                SELECT r.id, r.title, r.artist, r.reason, r.link,
-                       a.nickname,
-                       CASE
-                         WHEN instr(lower(r.link), 'youtu') > 0 THEN
-                           'https://img.youtube.com/vi/' ||
-                           substr(
-                             replace(
-                               replace(
-                                 replace(lower(r.link),
-                                   'https://www.youtube.com/watch?v=', ''),
-                                 'https://youtu.be/', ''),
-                               'https://youtube.com/shorts/', ''),
-                             1, 11
-                           ) || '/hqdefault.jpg'
-                         ELSE NULL
-                       END AS thumbnail
-                FROM recommendations r
-                LEFT JOIN accounts a ON a.id = r.account_id
-                WHERE r.account_id != :aid
-                ORDER BY RANDOM()
-                LIMIT 1
-            """), {"aid": u["id"]}).mappings().first()
-
-            if row:
-                conn.execute(text("""
-                    INSERT INTO draws (account_id, recommendation_id, created_at)
-                    VALUES (:aid, :rid, :now)
-                """), {"aid": u["id"], "rid": row["id"], "now": datetime.datetime.utcnow().isoformat()})
-
-        return jsonify({"ok": True, "drawn": dict(row) if row else None})
+            conn.execute(_Q_INSERT_RECO, {"aid": u["id"], "t": title, "a": artist, "r": reason, "l": link,
+                                          "yt": extract_yt_id(link)})
+
+            # 隨機抽卡：主鍵範圍取樣（index seek），抽中與寫入 draws 同一個 statement
+            lo, hi = conn.execute(_Q_RECO_ID_RANGE, {"aid": u["id"]}).first()
+            drawn_id = None
+            if lo is not None:  # 沒有別人的歌可抽就直接略過
+                for start in (random.randint(lo, hi), lo):  # 落在空洞時繞回範圍開頭重試
+                    drawn_id = conn.execute(_Q_DRAW_INTO_DRAWS, {"start": start, "aid": u["id"]}).scalar()
+                    if drawn_id:
+                        break
+            row = None
+            if drawn_id:
+                row = dict(conn.execute(_Q_RECO_DETAILS, {"rid": drawn_id}).mappings().first())
+                row["thumbnail"] = yt_thumb(row.pop("yt_id"))
+
+        return jsonify({"ok": True, "drawn": row})
+
+    @app.post("/submit/batch")
+    def submit_batch():
+        # 搭配 /autofill/batch 的多首一次投稿：整批一個 transaction、一次 fsync。
+        # 不附抽卡（抽卡留給單首 /submit 的儀式感）
+        u = current_user()
+        if not u:
+            return jsonify({"ok": False, "error": "not_logged_in"}), 401
+        payload = request.get_json(silent=True) or {}
+        items = payload.get("items")
+        if not isinstance(items, list) or not items:
+            return jsonify({"ok": False, "error": "missing_items"}), 400
+
+        params, errors = [], []
+        for i, it in enumerate(items):
+            if i >= 25:  # 超量的不能默默丟掉，逐筆回報讓 client 重送
+                errors.append({"index": i, "error": "batch_limit_exceeded"})
+                continue
+            it = it if isinstance(it, dict) else {}
+            title  = (it.get("title")  or "").strip()
+            artist = (it.get("artist") or "").strip()
+            reason = (it.get("reason") or "").strip()
+            link   = (it.get("link")   or "").strip()
+            if not link:
+                errors.append({"index": i, "error": "missing_link"})
+                continue
+            if not title or not artist:
+                errors.append({"index": i, "error": "missing_title_artist_autofill_first"})
+                continue
+            params.append({"aid": u["id"], "t": title, "a": artist, "r": reason, "l": link,
+                           "yt": extract_yt_id(link)})
+
+        if params:
+            with app.engine.begin() as conn:
+                conn.execute(_Q_INSERT_RECO, params)  # executemany：整批共用一次 commit
+
+        return jsonify({"ok": True, "inserted": len(params), "errors": errors})
 
     @app.get("/history")
     def history():
         u = current_user()
         if not u:
             return redirect(url_for("login"))
+        # keyset 分頁：用 draw_id 當游標，不管翻到多後面都走同一條索引
+        cursor = request.args.get("cursor", type=int) or 2**63 - 1
         with app.engine.begin() as conn:
-            rows = conn.execute(text("""
-                SELECT d.id as draw_id, d.created_at,
-                       r.title, r.artist, r.reason, r.link,
-                       a.nickname,
-                       CASE
-                         WHEN instr(lower(r.link), 'youtu') > 0 THEN
-                           'https://img.youtube.com/vi/' ||
-                           substr(
-                             replace(
-                               replace(
-                                 replace(lower(r.link),
-                                   'https://www.youtube.com/watch?v=', ''),
-                                 'https://youtu.be/', ''),
-                               'https://youtube.com/shorts/', ''),
-                             1, 11
-                           ) || '/hqdefault.jpg'
-                         ELSE NULL
-                       END AS thumbnail
-                FROM draws d
-                JOIN recommendations r ON r.id = d.recommendation_id
-                LEFT JOIN accounts a ON a.id = r.account_id
-                WHERE d.account_id = :aid
-                ORDER BY d.id DESC
-                LIMIT 100
-            """), {"aid": u["id"]}).mappings().all()
-        return render_template("history.html", title=f"{APP_TITLE} · History", items=rows, user=u)
+            rows = conn.execute(_Q_HISTORY, {"aid": u["id"], "cursor": cursor}).mappings().all()
+        next_cursor = rows[19]["draw_id"] if len(rows) > 20 else None
+        items = [dict(r) for r in rows[:20]]
+        for it in items:
+            it["thumbnail"] = yt_thumb(it.pop("yt_id"))
+        # stream_template 邊 render 邊送，長頁面 TTFB 低一點
+        return stream_template(
+            "history.html", title=f"{APP_TITLE} · History",
+            items=items, next_cursor=next_cursor, user=u,
+        )
 
     # --- Admin ---
-    import functools
     def require_admin(view):
         @functools.wraps(view)
         def wrapper(*args, **kwargs):
@@ -306,20 +602,15 @@ def create_app():
     @app.get("/admin")
     @require_admin
     def admin():
+        with _ADMIN_METRICS_LOCK:
+            metrics = _ADMIN_METRICS_CACHE.get("m")
         with app.engine.begin() as conn:
-            metrics = conn.execute(text("""
-                SELECT
-                  (SELECT COUNT(*) FROM accounts) as users,
-                  (SELECT COUNT(*) FROM recommendations) as recos,
-                  (SELECT COUNT(*) FROM draws) as draws
-            """)).mappings().first()
-            latest = conn.execute(text("""
-                SELECT r.id, r.title, r.artist, r.reason, r.link, r.created_at,
-                       a.email, a.nickname
-                FROM recommendations r
-                LEFT JOIN accounts a ON a.id = r.account_id
-                ORDER BY r.id DESC LIMIT 50
-            """)).mappings().all()
+            if metrics is None:
+                metrics = dict(conn.execute(_Q_ADMIN_METRICS).mappings().first())
+                with _ADMIN_METRICS_LOCK:
+                    _ADMIN_METRICS_CACHE["m"] = metrics
+            # latest 不快取：管理者要看的是最新投稿
+            latest = conn.execute(_Q_ADMIN_LATEST).mappings().all()
         return render_template("admin.html", title=f"{APP_TITLE} · Admin", metrics=metrics, rows=latest)
 
     return app
@@ -332,7 +623,7 @@ def init_db(app: Flask, engine: Engine):
                 google_sub TEXT,
                 email TEXT UNIQUE,
                 nickname TEXT,
-                created_at TEXT
+                created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
             );
         """))
         conn.execute(text("""
@@ -343,7 +634,8 @@ def init_db(app: Flask, engine: Engine):
                 artist TEXT NOT NULL,
                 reason TEXT,
                 link TEXT,
-                created_at TEXT,
+                yt_id TEXT,
+                created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
                 FOREIGN KEY(account_id) REFERENCES accounts(id)
             );
         """))
@@ -352,13 +644,43 @@ def init_db(app: Flask, engine: Engine):
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 account_id INTEGER NOT NULL,
                 recommendation_id INTEGER NOT NULL,
-                created_at TEXT,
+                created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
                 FOREIGN KEY(account_id) REFERENCES accounts(id),
                 FOREIGN KEY(recommendation_id) REFERENCES recommendations(id)
             );
         """))
+        # 既有的 ISO 字串時間一次性轉成 unix 整數
+        # 只挑含 '-' 的 ISO 字串，避免重跑時把已轉好的值餵給 strftime 變 NULL
+        for t in ("accounts", "recommendations", "draws"):
+            conn.execute(text(
+                f"UPDATE {t} SET created_at = CAST(strftime('%s', created_at) AS INTEGER) "
+                "WHERE typeof(created_at) = 'text' AND instr(created_at, '-') > 0"
+            ))
+            # 升級後、insert 還沒帶時間戳的那段期間寫出的 NULL，補成現在（真實時間已不可考）
+            conn.execute(text(
+                f"UPDATE {t} SET created_at = strftime('%s','now') WHERE created_at IS NULL"
+            ))
+
+        # 舊資料庫補 yt_id 欄位，並用連結回填一次
+        cols = {row[1] for row in conn.execute(text("PRAGMA table_info(recommendations)"))}
+        if "yt_id" not in cols:
+            conn.execute(text("ALTER TABLE recommendations ADD COLUMN yt_id TEXT;"))
+        rows = conn.execute(text(
+            "SELECT id, link FROM recommendations WHERE yt_id IS NULL AND link LIKE '%youtu%'"
+        )).all()
+        backfill = []
+        for rid, link in rows:
+            vid = extract_yt_id(link or "")
+            if vid:
+                backfill.append({"v": vid, "i": rid})
+        if backfill:
+            conn.execute(text("UPDATE recommendations SET yt_id = :v WHERE id = :i"), backfill)
+
         conn.execute(text("CREATE INDEX IF NOT EXISTS idx_reco_created ON recommendations(created_at);"))
-        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_draws_account ON draws(account_id);"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_reco_account ON recommendations(account_id);"))
+        conn.execute(text("DROP INDEX IF EXISTS idx_draws_account;"))  # 被下面的複合索引取代
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_draws_account_id_desc ON draws(account_id, id DESC);"))
+        conn.execute(text("ANALYZE;"))  # 更新 sqlite_stat1，讓 planner 願意用上面的索引
 
 app = create_app()
 
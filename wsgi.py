@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+# production entrypoint:
+#   gunicorn -k gthread --threads 8 -w 2 -b 0.0.0.0:5000 wsgi:app
+from newapp import app  # noqa: F401